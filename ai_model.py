@@ -1,7 +1,409 @@
 import os
-from openai import OpenAI
-import anthropic
+import asyncio
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+import openai
+from openai import OpenAI, AsyncOpenAI
+import boto3
+import httpx
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Per-provider request/token ceilings and the upper bound on in-flight calls.
+PROVIDER_PROFILES = {
+    'openai': {'rpm': 60, 'tpm': 150_000, 'max_concurrent': 10},
+    'anthropic': {'rpm': 50, 'tpm': 80_000, 'max_concurrent': 5},
+    'grok': {'rpm': 60, 'tpm': 100_000, 'max_concurrent': 5},
+    'perplexity': {'rpm': 50, 'tpm': 100_000, 'max_concurrent': 5},
+}
+
+# Prompts per request: the Completions API takes a list of prompts, while the
+# chat fallback packs several prompts into one tagged message.
+COMPLETIONS_BATCH_SIZE = 20
+CHAT_BATCH_SIZE = 5
+BATCH_SEPARATOR = "\n---\n"
+
+# Keep-alive pools shared by every call so TCP/TLS handshakes are paid once
+# per connection rather than once per prompt.
+HTTP_MAX_CONNECTIONS = 32
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16
+HTTP_LIMITS = httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS,
+                           max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+PERPLEXITY_TIMEOUT = (3.05, 30)
+
+_PERPLEXITY_SESSION = requests.Session()
+_PERPLEXITY_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.3,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset(["POST"]))
+))
+
+# Upper bound on a single provider request once it holds a concurrency slot,
+# so one slow response cannot hold up the whole sheet.
+CALL_TIMEOUT_SECONDS = 25
+# Per-attempt timeout of the async clients. CALL_TIMEOUT_SECONDS covers every
+# attempt of _retry_transient plus its backoff, so an attempt must be short
+# enough that a timed-out request still gets retried within it.
+ATTEMPT_TIMEOUT_SECONDS = 8
+
+# Output cap applied to every call; sized for the sheet's 80-word answers.
+DEFAULT_MAX_TOKENS = 128
+
+# Default model behind each provider's chat call; part of the response cache key.
+PROVIDER_MODELS = {
+    'openai': 'gpt-4o',
+    'anthropic': 'claude-1',
+    'grok': 'grok-2-latest',
+    'perplexity': 'perplexity-model',
+}
+# OpenAI sheet batches trade gpt-4o for the legacy Completions model, the only
+# one that takes a list of prompts per request. Its context is 4k tokens, so
+# prompts that would not fit (and private-data prompts, see abatch_call) are
+# sent one by one to PROVIDER_MODELS['openai'] instead.
+COMPLETIONS_MODEL = 'gpt-3.5-turbo-instruct'
+COMPLETIONS_CONTEXT_TOKENS = 4096
+
+CACHE_TABLE_NAME = 'qtp-ai-dynamo-db'
+CACHE_MAX_ENTRIES = 1024
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+# DynamoDB caps BatchGetItem at 100 keys and BatchWriteItem at 25 items
+CACHE_BATCH_GET_SIZE = 100
+CACHE_BATCH_WRITE_SIZE = 25
+CACHE_BATCH_ATTEMPTS = 3
+
+
+def _estimate_tokens(prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> int:
+    return len(prompt) // 4 + max_tokens
+
+
+def _status_code(error: BaseException) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None and getattr(error, "response", None) is not None:
+        status = getattr(error.response, "status_code", None)
+    return status
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    return _status_code(error) == 429
+
+
+_anthropic = None
+
+
+def _get_anthropic():
+    """
+    Imports the Anthropic SDK on first use so cold starts for other providers
+    don't pay for loading it
+    """
+    global _anthropic
+    if _anthropic is None:
+        import anthropic
+        _anthropic = anthropic
+    return _anthropic
+
+
+# Errors worth retrying; anything else (e.g. a 400 BadRequestError) fails fast.
+# Status errors are classified by code rather than by SDK exception class, so
+# e.g. Anthropic's OverloadedError (529) and ServiceUnavailableError (503) count.
+_TRANSIENT_ERRORS = (
+    openai.APIConnectionError,
+    httpx.TransportError,
+)
+_TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504, 529)
+
+
+def _is_transient(error: BaseException) -> bool:
+    if isinstance(error, _TRANSIENT_ERRORS):
+        return True
+    # Anthropic errors can only occur once its SDK has been loaded
+    if _anthropic is not None and isinstance(error, _anthropic.APIConnectionError):
+        return True
+    return _status_code(error) in _TRANSIENT_STATUS_CODES
+
+
+def _log_retry(retry_state) -> None:
+    model = retry_state.args[0]
+    prompt = retry_state.kwargs.get("prompt") or "\n".join(retry_state.kwargs.get("prompts", []))
+    error = retry_state.outcome.exception()
+    # The only place 429s reach the AIMD limiter: every 429 is retryable, so it
+    # always passes through here before the request gives up
+    if _is_rate_limited(error):
+        model._limiter.on_rate_limit()
+    fields = {
+        "provider": model.provider,
+        "prompt_hash": prompt_hash(prompt),
+        "attempt": retry_state.attempt_number,
+        "error": repr(error),
+    }
+    # Fields go in the message too: Lambda's default formatter drops `extra`
+    logger.warning("Retrying AI provider call after transient error "
+                   "provider=%s prompt_hash=%s attempt=%d error=%s",
+                   fields["provider"], fields["prompt_hash"], fields["attempt"], fields["error"],
+                   extra=fields)
+
+
+# Applied to the low-level async requests; the async SDK clients are built with
+# max_retries=0 so retries are not compounded.
+_retry_transient = retry(
+    retry=retry_if_exception(_is_transient),
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(4),
+    before_sleep=_log_retry,
+    reraise=True,
+)
+
+
+async def _collect_stream(stream) -> str:
+    pieces = []
+    async for chunk in stream:
+        if chunk.choices:
+            pieces.append(chunk.choices[0].delta.content or "")
+    return "".join(pieces)
+
+
+def _is_error_response(response) -> bool:
+    return not isinstance(response, str) or response.startswith("Error")
+
+
+def prompt_hash(prompt: str) -> str:
+    return hashlib.blake2b(prompt.encode(), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+    """
+    Two-tier cache of prompt responses: an in-process LRU in front of items in
+    the DynamoDB table, stored under a cache#<hash> partition key with a TTL.
+    Keys are scoped to the caller's API key, so a response is only served to
+    callers holding the key that paid for it.
+
+    Reads ignore expired items, but only DynamoDB deletes them: the table needs
+    TTL enabled on the ttl attribute or cache items accumulate forever.
+
+    DynamoDB is reached through one low-level client built up front, since
+    clients (unlike boto3 resources) are safe to share across the worker
+    threads the async methods run in. Lookups and writes are batched so a
+    column of prompts costs one BatchGetItem and one BatchWriteItem.
+
+    The DynamoDB tier is best effort; any error there is treated as a miss.
+    Error responses are never cached.
+    """
+
+    def __init__(self, table_name: str = CACHE_TABLE_NAME, maxsize: int = CACHE_MAX_ENTRIES,
+                 ttl_seconds: int = CACHE_TTL_SECONDS):
+        self.table_name = table_name
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._client = boto3.client('dynamodb', region_name='us-west-2')
+
+    @staticmethod
+    def key(provider: str, model: str, max_tokens: int, prompt: str, scope: str) -> str:
+        return f"cache#{prompt_hash(f'{scope}|{provider}|{model}|{max_tokens}|{prompt}')}"
+
+    def _remember(self, key: str, response: str) -> None:
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _lookup(self, keys: List[str]):
+        """
+        Splits keys into in-process hits and the keys still to fetch from DynamoDB
+        """
+        hits = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                hits[key] = self._entries[key]
+            else:
+                missing.append(key)
+        return hits, missing
+
+    def _fetch_many(self, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        now = time.time()
+        for start in range(0, len(keys), CACHE_BATCH_GET_SIZE):
+            request = {self.table_name: {
+                'Keys': [{'name': {'S': key}} for key in keys[start:start + CACHE_BATCH_GET_SIZE]],
+                'ProjectionExpression': '#n, #r, #t',
+                'ExpressionAttributeNames': {'#n': 'name', '#r': 'response', '#t': 'ttl'},
+            }}
+            try:
+                for _ in range(CACHE_BATCH_ATTEMPTS):
+                    response = self._client.batch_get_item(RequestItems=request)
+                    for item in response.get('Responses', {}).get(self.table_name, []):
+                        if float(item.get('ttl', {}).get('N', 0)) > now:
+                            found[item['name']['S']] = item['response']['S']
+                    request = response.get('UnprocessedKeys') or {}
+                    if not request:
+                        break
+                # Keys still unprocessed after the last attempt are treated as misses
+            except Exception as error:
+                logger.warning("Cache read failed: %s", error)
+        return found
+
+    def _persist_many(self, entries: Dict[str, str]) -> None:
+        expires = str(int(time.time()) + self.ttl_seconds)
+        writes = [{'PutRequest': {'Item': {
+            'name': {'S': key},
+            'response': {'S': response},
+            'ttl': {'N': expires},
+        }}} for key, response in entries.items()]
+        for start in range(0, len(writes), CACHE_BATCH_WRITE_SIZE):
+            request = {self.table_name: writes[start:start + CACHE_BATCH_WRITE_SIZE]}
+            try:
+                for _ in range(CACHE_BATCH_ATTEMPTS):
+                    response = self._client.batch_write_item(RequestItems=request)
+                    request = response.get('UnprocessedItems') or {}
+                    if not request:
+                        break
+            except Exception as error:
+                logger.warning("Cache write failed: %s", error)
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        hits, missing = self._lookup(keys)
+        if missing:
+            for key, response in self._fetch_many(missing).items():
+                self._remember(key, response)
+                hits[key] = response
+        return hits
+
+    def put_many(self, entries: Dict[str, str]) -> None:
+        entries = {key: response for key, response in entries.items()
+                   if not _is_error_response(response)}
+        for key, response in entries.items():
+            self._remember(key, response)
+        if entries:
+            self._persist_many(entries)
+
+    async def aget_many(self, keys: List[str]) -> Dict[str, str]:
+        hits, missing = self._lookup(keys)
+        if missing:
+            fetched = await asyncio.to_thread(self._fetch_many, missing)
+            for key, response in fetched.items():
+                self._remember(key, response)
+                hits[key] = response
+        return hits
+
+    async def aput_many(self, entries: Dict[str, str]) -> None:
+        entries = {key: response for key, response in entries.items()
+                   if not _is_error_response(response)}
+        for key, response in entries.items():
+            self._remember(key, response)
+        if entries:
+            await asyncio.to_thread(self._persist_many, entries)
+
+
+_RESPONSE_CACHE = ResponseCache()
+
+
+class RateLimiter:
+    """
+    Keeps calls under a provider's RPM/TPM ceiling using a sliding 60s window,
+    and adapts the concurrency cap with AIMD: halved on a 429, raised by one
+    after every window that completes without being throttled.
+    """
+    WINDOW_SECONDS = 60
+    ALPHA = 1
+    BETA = 0.5
+
+    def __init__(self, rpm: int, tpm: int, max_concurrent: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max_concurrent
+        self._limit = float(max_concurrent)
+        self._window = deque()
+        self._window_start = time.monotonic()
+        self._throttled = False
+        self._loop = None
+
+    def _bind_loop(self) -> None:
+        # asyncio primitives belong to one event loop. The Lambda handler reuses
+        # one loop per container (lambda_function._LOOP), so this normally binds
+        # once; it stays as a guard for callers driving a model from another
+        # loop, e.g. asyncio.run in a script or test.
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._window_lock = asyncio.Lock()
+            self._cond = asyncio.Condition()
+            self._in_flight = 0
+
+    async def _wait_for_window(self, tokens: int) -> None:
+        async with self._window_lock:
+            while True:
+                now = time.monotonic()
+                while self._window and now - self._window[0][0] >= self.WINDOW_SECONDS:
+                    self._window.popleft()
+                used = sum(t for _, t in self._window)
+                if not self._window or (len(self._window) < self.rpm and used + tokens <= self.tpm):
+                    self._window.append((now, tokens))
+                    return
+                await asyncio.sleep(self.WINDOW_SECONDS - (now - self._window[0][0]))
+
+    def _additive_increase(self) -> None:
+        now = time.monotonic()
+        if now - self._window_start >= self.WINDOW_SECONDS:
+            if not self._throttled:
+                self._limit = min(float(self.max_concurrent), self._limit + self.ALPHA)
+            self._throttled = False
+            self._window_start = now
+
+    @asynccontextmanager
+    async def slot(self, tokens: int):
+        """
+        Waits until the call fits in the RPM/TPM window and a concurrency slot is free
+        """
+        self._bind_loop()
+        await self._wait_for_window(tokens)
+        async with self._cond:
+            self._additive_increase()
+            await self._cond.wait_for(lambda: self._in_flight < max(1, int(self._limit)))
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def on_rate_limit(self) -> None:
+        """
+        Multiplicative decrease of the concurrency cap after a 429, applied at
+        most once per window so a burst of throttled requests (or one request's
+        retries) only halves the cap once
+        """
+        if self._throttled and time.monotonic() - self._window_start < self.WINDOW_SECONDS:
+            return
+        self._limit = max(1.0, self._limit * self.BETA)
+        self._throttled = True
+
+
+def _sdk_http_client(sdk, use_async: bool):
+    """
+    Builds a pooled HTTP client for an SDK from its own Default*HttpxClient,
+    since each SDK only accepts clients (and limits) from the httpx it ships with
+    """
+    limits = type(sdk.DEFAULT_CONNECTION_LIMITS)(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS)
+    client_cls = sdk.DefaultAsyncHttpxClient if use_async else sdk.DefaultHttpxClient
+    return client_cls(limits=limits)
+
 
 class AIModel:
     def __init__(self, provider: str):
@@ -9,6 +411,11 @@ class AIModel:
         if provider.lower() not in valid_providers:
             raise ValueError(f"Unsupported provider. Must be one of: {valid_providers}")
         self.provider = provider.lower()
+        self._limiter = RateLimiter(**PROVIDER_PROFILES[self.provider])
+        self._api_key = os.environ.get(f"{self.provider.upper()}_API_KEY", "").strip()
+        self._client = None
+        self._aclient = None
+        self._aclient_loop = None
 
     def set_api_key(self, api_key: str) -> None:
         """
@@ -25,76 +432,379 @@ class AIModel:
             
         env_var_name = f"{self.provider.upper()}_API_KEY"
         os.environ[env_var_name] = api_key.strip()
+        if api_key.strip() != self._api_key:
+            self._client = None
+            self._aclient = None
+        self._api_key = api_key.strip()
         
-        print(f"API key for {self.provider} has been set as environment variable {env_var_name}")
+        logger.debug("API key for %s has been set as environment variable %s", self.provider, env_var_name)
+
+    def _build_client(self, use_async: bool):
+        if self.provider == 'perplexity':
+            # Perplexity has no SDK: sync calls share _PERPLEXITY_SESSION and
+            # async calls go through a pooled httpx client directly
+            if not use_async:
+                return None
+            connect, _ = PERPLEXITY_TIMEOUT
+            return httpx.AsyncClient(limits=HTTP_LIMITS,
+                                     timeout=httpx.Timeout(ATTEMPT_TIMEOUT_SECONDS, connect=connect))
+        # Async requests are retried by _retry_transient instead of the SDK
+        max_retries = 0 if use_async else 3
+        timeout = ATTEMPT_TIMEOUT_SECONDS if use_async else 20
+        if self.provider == 'anthropic':
+            anthropic = _get_anthropic()
+            http_client = _sdk_http_client(anthropic, use_async)
+            client_cls = anthropic.AsyncAnthropic if use_async else anthropic.Anthropic
+            return client_cls(api_key=self._api_key, timeout=timeout, max_retries=max_retries,
+                              http_client=http_client)
+        http_client = _sdk_http_client(openai, use_async)
+        client_cls = AsyncOpenAI if use_async else OpenAI
+        if self.provider == 'grok':
+            return client_cls(api_key=self._api_key, base_url="https://api.x.ai/v1",
+                              timeout=timeout, max_retries=max_retries, http_client=http_client)
+        return client_cls(api_key=self._api_key, timeout=timeout, max_retries=max_retries,
+                          http_client=http_client)
+
+    def _get_client(self):
+        """
+        Returns the provider SDK client, built once and reused across calls
+        """
+        if self._client is None:
+            self._client = self._build_client(use_async=False)
+        return self._client
+
+    def _get_async_client(self):
+        """
+        Returns the async provider SDK client. Its connection pool is bound to
+        the loop it was created on; the handler keeps one loop per container so
+        it is built once, but it is rebuilt if the model is used from another loop
+        """
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._aclient_loop is not loop:
+            self._aclient = self._build_client(use_async=True)
+            self._aclient_loop = loop
+        return self._aclient
 
-    def call(self, prompt: str):
+    def _cache_key(self, prompt: str, max_tokens: int, model: Optional[str] = None) -> str:
+        return ResponseCache.key(self.provider, model or PROVIDER_MODELS[self.provider],
+                                 max_tokens, prompt, scope=prompt_hash(self._api_key))
+
+    def call(self, prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS):
         """
         Makes an API call to the specified AI provider.
         
         Dynamically calls the appropriate method based on the provider name.
+        Identical prompts sent with the same API key are answered from the
+        response cache.
         """
         provider_method = f"{self.provider}_api_call"
         method = getattr(self, provider_method, None)
         if method is None:
             return f"Error: Unsupported AI provider '{self.provider}'."
-        return method(prompt)
+        key = self._cache_key(prompt, max_tokens)
+        cached = _RESPONSE_CACHE.get_many([key])
+        if key in cached:
+            return cached[key]
+        result = method(prompt, max_tokens=max_tokens)
+        _RESPONSE_CACHE.put_many({key: result})
+        return result
+
+    async def acall(self, prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS):
+        """
+        Makes an asynchronous API call to the specified AI provider.
+
+        Identical prompts sent with the same API key are answered from the
+        response cache; misses are dispatched through the provider's rate limiter.
+        """
+        key = self._cache_key(prompt, max_tokens)
+        cached = await _RESPONSE_CACHE.aget_many([key])
+        if key in cached:
+            return cached[key]
+        result = await self._adispatch(prompt, max_tokens)
+        await _RESPONSE_CACHE.aput_many({key: result})
+        return result
+
+    async def _adispatch(self, prompt: str, max_tokens: int):
+        """
+        Dynamically awaits the appropriate async method based on the provider name,
+        throttled by the provider's rate limiter.
+        """
+        provider_method = f"a{self.provider}_api_call"
+        method = getattr(self, provider_method, None)
+        if method is None:
+            return f"Error: Unsupported AI provider '{self.provider}'."
+        async with self._limiter.slot(_estimate_tokens(prompt, max_tokens)):
+            try:
+                return await asyncio.wait_for(method(prompt, max_tokens=max_tokens),
+                                              timeout=CALL_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                return f"Error calling AI service: no response within {CALL_TIMEOUT_SECONDS}s"
+
+    async def abatch_call(self, prompts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS,
+                          use_completions: bool = True) -> List[str]:
+        """
+        Answers several prompts with as few requests as possible.
+
+        Cached prompts are answered directly. For the rest, OpenAI sends a list of
+        prompts per Completions request (prompts too long for COMPLETIONS_MODEL
+        go to the chat model one at a time); other providers pack prompts into
+        one chat message with <<<i>>>-tagged answers.
+
+        Args:
+            prompts: The prompts to send
+            max_tokens: Output cap per prompt
+            use_completions: False to keep OpenAI prompts on the chat model, e.g.
+                when they carry private data too large for COMPLETIONS_MODEL
+
+        Returns:
+            One response per prompt, in the same order
+        """
+        if self.provider == 'openai':
+            batched = [use_completions and _estimate_tokens(prompt, max_tokens) <= COMPLETIONS_CONTEXT_TOKENS
+                       for prompt in prompts]
+            batch_size, method, model = COMPLETIONS_BATCH_SIZE, self._acompletions_batch, COMPLETIONS_MODEL
+        else:
+            batched = [True] * len(prompts)
+            batch_size, method, model = CHAT_BATCH_SIZE, self._achat_batch, None
+        keys = [self._cache_key(prompt, max_tokens, model if batch else None)
+                for prompt, batch in zip(prompts, batched)]
+        cached = await _RESPONSE_CACHE.aget_many(keys)
+        results = [cached.get(key) for key in keys]
+        misses = [i for i, result in enumerate(results) if result is None]
+        batch_misses = [i for i in misses if batched[i]]
+        chunks = [batch_misses[i:i + batch_size] for i in range(0, len(batch_misses), batch_size)]
+        calls = [method([prompts[i] for i in chunk], max_tokens) for chunk in chunks]
+        # Prompts kept out of the batches go to the chat model one at a time
+        singles = [i for i in misses if not batched[i]]
+        chunks += [[i] for i in singles]
+        calls += [self._achat_batch([prompts[i]], max_tokens) for i in singles]
+        responses = await asyncio.gather(*calls)
+        for chunk, chunk_responses in zip(chunks, responses):
+            for i, response in zip(chunk, chunk_responses):
+                results[i] = response
+        await _RESPONSE_CACHE.aput_many({keys[i]: results[i] for i in misses})
+        return results
+
+    async def _acompletions_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        if not self._api_key:
+            return ["Error: OpenAI API key not found in environment variables"] * len(prompts)
+        tokens = sum(_estimate_tokens(prompt, max_tokens) for prompt in prompts)
+        async with self._limiter.slot(tokens):
+            try:
+                return await asyncio.wait_for(
+                    self._acompletions_request(prompts=prompts, max_tokens=max_tokens),
+                    timeout=CALL_TIMEOUT_SECONDS)
+            except openai.BadRequestError as error:
+                logger.warning("API call rejected: %s", error)
+                rejected = f"Error: request rejected by AI service: {str(error)}"
+            except asyncio.TimeoutError:
+                return [f"Error calling AI service: no response within {CALL_TIMEOUT_SECONDS}s"] * len(prompts)
+            except Exception as error:
+                logger.warning("API call failed: %s", error)
+                return [f"Error calling AI service: {str(error)}"] * len(prompts)
+        if len(prompts) == 1:
+            return [rejected]
+        # One bad prompt rejects the whole request; retry each prompt on its
+        # own so only the offending ones fail
+        responses = await asyncio.gather(*(self._acompletions_batch([prompt], max_tokens)
+                                           for prompt in prompts))
+        return [response for (response,) in responses]
+
+    @_retry_transient
+    async def _acompletions_request(self, prompts: List[str], max_tokens: int) -> List[str]:
+        client = self._get_async_client()
+        response = await client.completions.create(
+            model=COMPLETIONS_MODEL,
+            prompt=prompts,
+            max_tokens=max_tokens
+        )
+        return [c.text.strip() for c in sorted(response.choices, key=lambda c: c.index)]
+
+    async def _achat_batch(self, prompts: List[str], max_tokens: int) -> List[str]:
+        if len(prompts) == 1:
+            return [await self._adispatch(prompts[0], max_tokens)]
+        combined = (
+            f"Answer each of the following {len(prompts)} requests independently. "
+            "Start the answer to request i with the tag <<<i>>> on its own line "
+            "and do not output anything outside the tagged answers.\n"
+            + BATCH_SEPARATOR.join(f"<<<{i}>>>\n{prompt}" for i, prompt in enumerate(prompts))
+        )
+        result = await self._adispatch(combined, max_tokens * len(prompts))
+        answers = {}
+        parts = re.split(r"<<<(\d+)>>>", result)
+        for tag, answer in zip(parts[1::2], parts[2::2]):
+            answers[int(tag)] = answer.strip().removesuffix(BATCH_SEPARATOR.strip()).strip()
+        if not answers:
+            # Untagged output is usually an error message; report it for every prompt
+            return [result] * len(prompts)
+        return [answers.get(i, "Error: no answer returned for this prompt") for i in range(len(prompts))]
     
-    def openai_api_call(self, prompt: str) -> str:
+    def submit_batch(self, prompts: List[str], max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Submits prompts to the provider's offline batch API, answered within 24h
+        at a discount and outside the synchronous rate limits.
+
+        The custom_id of each request is its index in prompts.
+
+        Args:
+            prompts: The prompts to send
+            max_tokens: Output cap per prompt
+
+        Returns:
+            The batch id to pass to poll_batch
+        """
+        method = getattr(self, f"_{self.provider}_submit_batch", None)
+        if method is None:
+            raise ValueError(f"Batch mode is not supported for provider '{self.provider}'")
+        return method(prompts, max_tokens)
+
+    def poll_batch(self, batch_id: str) -> Dict[str, Any]:
+        """
+        Checks a batch submitted with submit_batch
+
+        Args:
+            batch_id: The id returned by submit_batch
+
+        Returns:
+            Dict with the batch status ('completed' once results are ready) and
+            the results keyed by custom_id
+        """
+        method = getattr(self, f"_{self.provider}_poll_batch", None)
+        if method is None:
+            raise ValueError(f"Batch mode is not supported for provider '{self.provider}'")
+        return method(batch_id)
+
+    def _openai_submit_batch(self, prompts: List[str], max_tokens: int) -> str:
+        lines = [
+            json.dumps({
+                "custom_id": f"{i}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o",
+                    "max_tokens": max_tokens,
+                    "messages": [{"role": "user", "content": prompt}]
+                }
+            })
+            for i, prompt in enumerate(prompts)
+        ]
+        client = self._get_client()
+        batch_file = client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    def _openai_poll_batch(self, batch_id: str) -> Dict[str, Any]:
+        client = self._get_client()
+        batch = client.batches.retrieve(batch_id)
+        if batch.status != "completed":
+            return {"status": batch.status, "results": {}}
+        results = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                response = item.get("response") or {}
+                if response.get("status_code") == 200:
+                    results[item["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+                else:
+                    error = item.get("error") or response.get("body", {}).get("error")
+                    results[item["custom_id"]] = f"Error calling AI service: {error}"
+        return {"status": "completed", "results": results}
+
+    def _anthropic_submit_batch(self, prompts: List[str], max_tokens: int,
+                                model: str = "claude-1") -> str:
+        client = self._get_client()
+        batch = client.messages.batches.create(
+            requests=[
+                {
+                    "custom_id": f"{i}",
+                    "params": {
+                        "model": model,
+                        "max_tokens": max_tokens,
+                        "messages": [{"role": "user", "content": prompt}]
+                    }
+                }
+                for i, prompt in enumerate(prompts)
+            ]
+        )
+        return batch.id
+
+    def _anthropic_poll_batch(self, batch_id: str) -> Dict[str, Any]:
+        client = self._get_client()
+        batch = client.messages.batches.retrieve(batch_id)
+        if batch.processing_status != "ended":
+            return {"status": batch.processing_status, "results": {}}
+        results = {}
+        for entry in client.messages.batches.results(batch_id):
+            if entry.result.type == "succeeded":
+                results[entry.custom_id] = entry.result.message.content[0].text
+            else:
+                results[entry.custom_id] = f"Error calling AI service: {entry.result.type}"
+        return {"status": "completed", "results": results}
+
+    def openai_api_call(self, prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
         """
         Makes an API call to OpenAI
         
         Args:
             prompt: The prompt to send
             model: The model to use
+            max_tokens: Output token cap
             
         Returns:
             The response from the API
         """
-        # Get API key from environment variable for security
-        OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-        
-        if not OPENAI_API_KEY:
+        if not self._api_key:
             return "Error: OpenAI API key not found in environment variables"
-        from openai import OpenAI
         try:
-            client = OpenAI()
+            client = self._get_client()
             completion = client.chat.completions.create(
             model="gpt-4o",
+            max_tokens=max_tokens,
             messages=[
                 {"role": "user", "content": prompt}
             ]
             )
 
-            print(completion.choices[0].message) # test
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("message=%s", completion.choices[0].message)
     
             return completion.choices[0].message.content
         except Exception as error:
-            print(f"API call failed: {error}")
+            logger.warning("API call failed: %s", error)
             return f"Error calling AI service: {str(error)}"
 
-    def anthropic_api_call(self, prompt: str, model: str = "claude-1") -> str:
+    def anthropic_api_call(self, prompt: str, model: str = "claude-1",
+                           max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
         """
         Makes an API call to Anthropic's Claude model
         
         Args:
             prompt: The prompt to send
             model: The model to use (default is claude-1)
+            max_tokens: Output token cap
             
         Returns:
             The response from the API
         """
-        # Get API key from environment variable for security
-        ANTHROPIC_API_KEY = os.environ.get('ANTHROPIC_API_KEY')
-        
-        if not ANTHROPIC_API_KEY:
+        if not self._api_key:
             return "Error: Anthropic API key not found in environment variables"
         
         try:
-            client = anthropic.Client(ANTHROPIC_API_KEY)
+            client = self._get_client()
             message = client.messages.create(
                 model=model,
-                max_tokens=100,
+                max_tokens=max_tokens,
                 messages=[{
                     "role": "user",
                     "content": prompt
@@ -102,74 +812,210 @@ class AIModel:
             )
             return message.content[0].text
         except Exception as error:
-            print(f"API call failed: {error}")
+            logger.warning("API call failed: %s", error)
             return f"Error calling AI service: {str(error)}"
 
-    def grok_api_call(self, prompt: str, model: str = "grok-model") -> str:
+    def grok_api_call(self, prompt: str, model: str = "grok-model",
+                      max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
         """
         Makes an API call to Grok's model
         
         Args:
             prompt: The prompt to send
             model: The model to use (default is grok-model)
+            max_tokens: Output token cap
             
         Returns:
             The response from the API
         """
-        # Get API key from environment variable for security
-        GROK_API_KEY = os.environ.get('GROK_API_KEY')
-        
-        if not GROK_API_KEY:
+        if not self._api_key:
             return "Error: Grok API key not found in environment variables"
         
-        client = OpenAI(
-        api_key=GROK_API_KEY,
-        base_url="https://api.x.ai/v1",
-        )
+        client = self._get_client()
 
         completion = client.chat.completions.create(
         model="grok-2-latest",
+        max_tokens=max_tokens,
         messages=[{"role": "user", "content": prompt}]
         )
         try:
-            print(completion.choices[0].message) # test
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("message=%s", completion.choices[0].message)
             return completion.choices[0].message.content
         except requests.exceptions.RequestException as error:
-            print(f"API call failed: {error}")
+            logger.warning("API call failed: %s", error)
             return f"Error calling AI service: {str(error)}"
 
-    def perplexity_api_call(self, prompt: str, model: str = "perplexity-model") -> str:
+    def perplexity_api_call(self, prompt: str, model: str = "perplexity-model",
+                            max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
         """
         Makes an API call to Perplexity AI
         
         Args:
             prompt: The prompt to send
             model: The model to use (default is perplexity-model)
+            max_tokens: Output token cap
             
         Returns:
             The response from the API
         """
-        # Get API key from environment variable for security
-        PERPLEXITY_API_KEY = os.environ.get('PERPLEXITY_API_KEY')
-        
-        if not PERPLEXITY_API_KEY:
+        if not self._api_key:
             return "Error: Perplexity API key not found in environment variables"
         
         url = "https://api.perplexity.ai/v1/chat/completions"
         headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
+            "Authorization": f"Bearer {self._api_key}",
             "Content-Type": "application/json"
         }
         data = {
             "model": model,
+            "max_tokens": max_tokens,
             "messages": [{"role": "user", "content": prompt}]
         }
 
         try:
-            response = requests.post(url, json=data, headers=headers)
+            response = _PERPLEXITY_SESSION.post(url, json=data, headers=headers,
+                                                timeout=PERPLEXITY_TIMEOUT)
             response.raise_for_status()
             result = response.json()
             return result['choices'][0]['message']['content']
         except requests.exceptions.RequestException as error:
-            print(f"API call failed: {error}")
+            logger.warning("API call failed: %s", error)
             return f"Error calling AI service: {str(error)}"
+
+    async def aopenai_api_call(self, prompt: str, max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Makes an asynchronous API call to OpenAI
+
+        Args:
+            prompt: The prompt to send
+            max_tokens: Output token cap
+
+        Returns:
+            The response from the API
+        """
+        if not self._api_key:
+            return "Error: OpenAI API key not found in environment variables"
+        try:
+            return await self._astream_chat(model="gpt-4o", prompt=prompt, max_tokens=max_tokens)
+        except openai.BadRequestError as error:
+            logger.warning("API call rejected: %s", error)
+            return f"Error: request rejected by AI service: {str(error)}"
+        except Exception as error:
+            logger.warning("API call failed: %s", error)
+            return f"Error calling AI service: {str(error)}"
+
+    async def aanthropic_api_call(self, prompt: str, model: str = "claude-1",
+                                  max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Makes an asynchronous API call to Anthropic's Claude model
+
+        Args:
+            prompt: The prompt to send
+            model: The model to use (default is claude-1)
+            max_tokens: Output token cap
+
+        Returns:
+            The response from the API
+        """
+        if not self._api_key:
+            return "Error: Anthropic API key not found in environment variables"
+
+        anthropic = _get_anthropic()
+        try:
+            return await self._aanthropic_request(model=model, prompt=prompt, max_tokens=max_tokens)
+        except anthropic.BadRequestError as error:
+            logger.warning("API call rejected: %s", error)
+            return f"Error: request rejected by AI service: {str(error)}"
+        except Exception as error:
+            logger.warning("API call failed: %s", error)
+            return f"Error calling AI service: {str(error)}"
+
+    async def agrok_api_call(self, prompt: str, model: str = "grok-model",
+                             max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Makes an asynchronous API call to Grok's model
+
+        Args:
+            prompt: The prompt to send
+            model: The model to use (default is grok-model)
+            max_tokens: Output token cap
+
+        Returns:
+            The response from the API
+        """
+        if not self._api_key:
+            return "Error: Grok API key not found in environment variables"
+
+        try:
+            return await self._astream_chat(model="grok-2-latest", prompt=prompt, max_tokens=max_tokens)
+        except openai.BadRequestError as error:
+            logger.warning("API call rejected: %s", error)
+            return f"Error: request rejected by AI service: {str(error)}"
+        except Exception as error:
+            logger.warning("API call failed: %s", error)
+            return f"Error calling AI service: {str(error)}"
+
+    async def aperplexity_api_call(self, prompt: str, model: str = "perplexity-model",
+                                   max_tokens: int = DEFAULT_MAX_TOKENS) -> str:
+        """
+        Makes an asynchronous API call to Perplexity AI
+
+        Args:
+            prompt: The prompt to send
+            model: The model to use (default is perplexity-model)
+            max_tokens: Output token cap
+
+        Returns:
+            The response from the API
+        """
+        if not self._api_key:
+            return "Error: Perplexity API key not found in environment variables"
+
+        try:
+            return await self._aperplexity_request(model=model, prompt=prompt, max_tokens=max_tokens)
+        except httpx.HTTPError as error:
+            logger.warning("API call failed: %s", error)
+            return f"Error calling AI service: {str(error)}"
+
+    @_retry_transient
+    async def _astream_chat(self, model: str, prompt: str, max_tokens: int) -> str:
+        client = self._get_async_client()
+        stream = await client.chat.completions.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{"role": "user", "content": prompt}],
+            stream=True
+        )
+        return await _collect_stream(stream)
+
+    @_retry_transient
+    async def _aanthropic_request(self, model: str, prompt: str, max_tokens: int) -> str:
+        client = self._get_async_client()
+        message = await client.messages.create(
+            model=model,
+            max_tokens=max_tokens,
+            messages=[{
+                "role": "user",
+                "content": prompt
+            }]
+        )
+        return message.content[0].text
+
+    @_retry_transient
+    async def _aperplexity_request(self, model: str, prompt: str, max_tokens: int) -> str:
+        url = "https://api.perplexity.ai/v1/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {self._api_key}",
+            "Content-Type": "application/json"
+        }
+        data = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": [{"role": "user", "content": prompt}]
+        }
+        client = self._get_async_client()
+        response = await client.post(url, json=data, headers=headers)
+        response.raise_for_status()
+        result = response.json()
+        return result['choices'][0]['message']['content']
@@ -1,12 +1,57 @@
 import os
 
-import json
+import asyncio
+import logging
+import string
 import requests
-from typing import List, Dict, Any, Union
+from typing import List, Dict, Any, Tuple, Union
+import time
 import boto3
-from boto3.dynamodb.conditions import Key
+import orjson
 import ai_model
-from multiprocessing import Process, Pipe, freeze_support
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# DynamoDB caps BatchGetItem at 100 keys per request
+BATCH_GET_SIZE = 100
+BATCH_GET_ATTEMPTS = 5
+TABLE_NAME = 'qtp-ai-dynamo-db'
+
+# Built once per container and reused by warm invocations
+_DDB = boto3.resource('dynamodb', region_name='us-west-2')
+_MODELS: Dict[str, ai_model.AIModel] = {}
+# One event loop per container: the async clients' connection pools are bound
+# to the loop they were created on, so asyncio.run (a fresh loop per
+# invocation) would rebuild them every time
+_LOOP = asyncio.new_event_loop()
+
+# Static analyst instructions, built once at import instead of per prompt
+_PROMPT_PREFIX = (
+    "Act as a financial analyst for an investment banking company.\n"
+    "Be concise with your word, and only provide information needed."
+)
+_PROMPT_OUTPUTS_RULE = (
+    "If outputs were to be links, names, numerical figures, contact, etc; that do not require textual\n"
+    "description, ONLY provide that output, nothing else."
+)
+_PROMPT_LIMIT = "Limit output to less than 80 words, no more than this."
+_PROMPT_TMPL = string.Template(
+    f"{_PROMPT_PREFIX} Evaluate the company $company,\n"
+    f"by answer the following questions: $prompt.\n"
+    f"{_PROMPT_OUTPUTS_RULE}\n"
+    f"{_PROMPT_LIMIT}"
+)
+
+def get_model(provider: str) -> ai_model.AIModel:
+    """
+    Returns the AIModel for a provider, reusing the instance (and its pooled
+    clients, rate limiter state and response cache) across warm invocations
+    """
+    key = provider.lower()
+    if key not in _MODELS:
+        _MODELS[key] = ai_model.AIModel(provider)
+    return _MODELS[key]
 
 def lambda_handler(event, context):
     """
@@ -20,41 +65,14 @@ def lambda_handler(event, context):
         Formatted response for AppScript
     """
     try:
-        # Extract parameters from the event
-        company_names = event.get('companies', [])
-        prompts = event.get('prompts', [])
-        provider = event.get('provider', '')
-        api_key = event.get('api_key', '')
-        number = event.get('number', 10)
-        create_list = event.get('create_list', False)
-        private_data = event.get('private_data', False)
-
-        model = ai_model.AIModel(provider)
-
-        # When you receive an API key, set it as an environment variable
-        model.set_api_key(api_key)
-
-        # Ensure company_names and prompts are lists
-        if not isinstance(company_names, list):
-            company_names = [company_names] if company_names else []
-        
-        if not isinstance(prompts, list):
-            prompts = [prompts] if prompts else []
-        
-        # Filter out empty values
-        companies = [name for name in company_names if name]
-        prompts = [p for p in prompts if p]
-        
-        if create_list == True:
-            companies = generate_companies(companies, number, model)
-        result = parallel_ai_call(companies, prompts, private_data, model)
-        print("reach after calling ai") #test
+        result = _LOOP.run_until_complete(_handler(event))
+        logger.debug("reach after calling ai")
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps(result)
+            'body': orjson.dumps(result).decode()
         }
     except Exception as e:
         return {
@@ -62,65 +80,131 @@ def lambda_handler(event, context):
             'headers': {
                 'Content-Type': 'application/json'
             },
-            'body': json.dumps({
+            'body': orjson.dumps({
                 'error': str(e)
-            })
+            }).decode()
         }
 
-def sheet_ai_call(company: str, prompt: str, private_data,
-           model, conn) -> Dict[str, Any]:
+async def _handler(event) -> Dict[str, Any]:
     """
-    Generates GPT responses for companies based on prompts
+    Resolves the company list and private data, then runs the prompts
     
     Args:
-        companies: List of company names
-        prompts: List of prompts to send to GPT
-        provider: AI provider (default: "openai")
-        private_dataL boolean, if true then use data frm dynamoDB
+        event: The event dict containing the input parameters
         
     Returns:
         Formatted output data
     """
+    # Extract parameters from the event
+    company_names = event.get('companies', [])
+    prompts = event.get('prompts', [])
+    provider = event.get('provider', '')
+    api_key = event.get('api_key', '')
+    number = event.get('number', 10)
+    create_list = event.get('create_list', False)
+    private_data = event.get('private_data', False)
+    mode = event.get('mode', '')
+    batch_id = event.get('batch_id', '')
+
+    model = get_model(provider)
+
+    # When you receive an API key, set it as an environment variable
+    model.set_api_key(api_key)
+
+    # Ensure company_names and prompts are lists
+    if not isinstance(company_names, list):
+        company_names = [company_names] if company_names else []
+    
+    if not isinstance(prompts, list):
+        prompts = [prompts] if prompts else []
+    
+    # Filter out empty values
+    companies = [name for name in company_names if name]
+    prompts = [p for p in prompts if p]
+    
+    # A batch poll must reuse the company list it was submitted with, and its
+    # prompts were already built with any private data
+    if create_list == True and not batch_id:
+        companies = await agenerate_companies(companies, number, model)
+    # Private data is per company, so fetch it once for all prompts. It can only
+    # be read once the final company list is known.
+    private_map = None
+    if private_data and not batch_id:
+        private_map = await asyncio.to_thread(batch_read_dynamo, companies)
+
+    if mode == 'batch':
+        return await asyncio.to_thread(batch_ai_call, companies, prompts, private_map, model, batch_id)
+    return await parallel_ai_call(companies, prompts, private_map, model)
+
+def build_sheet_prompt(company: str, prompt: str, private_data_result=None) -> str:
+    """
+    Builds the analyst prompt for a single company and question
+    
+    Args:
+        company: Company name
+        prompt: Question to answer about the company
+        private_data_result: the company's dynamoDB data; left out when None or empty
+        
+    Returns:
+        The full prompt to send to the AI model
+    """
+    parts = [_PROMPT_TMPL.substitute(company=company, prompt=prompt)]
+    if private_data_result:
+        parts.append(" Incorporate this data as a reference: ")
+        parts.append(orjson.dumps(private_data_result, default=str).decode())
+    return "".join(parts)
+
+async def sheet_ai_call(companies: List[str], full_prompts: List[str],
+           model, use_completions: bool = True) -> List[Union[str, Dict[str, Any]]]:
+    """
+    Generates AI responses for a column of prompts, batched into as few
+    requests as the provider allows
+    
+    Args:
+        companies: Company name behind each prompt, used in error messages
+        full_prompts: Prompts built with build_sheet_prompt
+        model: AIModel instance used for the call
+        use_completions: False to keep OpenAI prompts off the batched Completions model
+        
+    Returns:
+        One response per prompt, in order
+    """
     try:
-        full_prompt = f"""
-        Act as a financial analyst for an investment banking company.
-        Be concise with your word, and only provide information needed. Evaluate the company {company},
-        by answer the following questions: {prompt}.
-        If outputs were to be links, names, numerical figures, contact, etc; that do not require textual
-        description, ONLY provide that output, nothing else.
-        Limit output to less than 80 words, no more than this.
-        """
-        if private_data:
-            private_data_result = read_dynamo(company)
-            full_prompt += " Incorporate this data as a reference: " + str(private_data_result)
-        result = model.call(full_prompt)
-        conn.send([result])
+        return await model.abatch_call(full_prompts, use_completions=use_completions)
     except Exception as e:
-        conn.send([{"error": True, "message": {"content": f"Error processing {company}: {str(e)}"}}])
-    finally:
-        conn.close()
-
-def parallel_ai_call(companies: List[str], prompts: List[str], private_data, model) -> Dict[str, Any]:
-    company_results = {company: [company] for company in companies}
-
-    for prompt in prompts:
-        processes = []
-        parent_connections = {}
-        for company in companies:
-            parent_conn, child_conn = Pipe()
-            parent_connections[company] = parent_conn
-            process = Process(target=sheet_ai_call, args=(company, prompt, private_data, model, child_conn))
-            processes.append(process)
-            process.start()
- 
-        for process in processes:
-            process.join()
-
-        for company, conn in parent_connections.items():
-            result = conn.recv()[0]
-            company_results[company].append(result)
+        return [{"error": True, "message": {"content": f"Error processing {company}: {str(e)}"}}
+                for company in companies]
+
+async def parallel_ai_call(companies: List[str], prompts: List[str], private_map, model) -> Dict[str, Any]:
+    # Identical full prompts (duplicate prompts or companies, shared private data)
+    # are sent once and their response is written to every cell that needs it
+    by_hash: Dict[str, List[Tuple[int, int]]] = {}
+    columns: List[List[Tuple[str, str]]] = [[] for _ in prompts]
+    for ci, company in enumerate(companies):
+        private_data_result = private_map.get(company) if private_map is not None else None
+        for pi, prompt in enumerate(prompts):
+            full_prompt = build_sheet_prompt(company, prompt, private_data_result)
+            key = ai_model.prompt_hash(full_prompt)
+            if key not in by_hash:
+                by_hash[key] = []
+                columns[pi].append((key, full_prompt))
+            by_hash[key].append((ci, pi))
+
+    # One batched call per prompt column, as before
+    async def run_column(column):
+        column_companies = [companies[by_hash[key][0][0]] for key, _ in column]
+        column_prompts = [full_prompt for _, full_prompt in column]
+        # Private data can overflow the 4k context of the batched OpenAI model
+        return column, await sheet_ai_call(column_companies, column_prompts, model,
+                                           use_completions=private_map is None)
+
+    results = [[company] + [None] * len(prompts) for company in companies]
+    for next_column in asyncio.as_completed([run_column(column) for column in columns if column]):
+        column, column_results = await next_column
+        for (key, _), result in zip(column, column_results):
+            for ci, pi in by_hash[key]:
+                results[ci][pi + 1] = result
     
-    results = list(company_results.values())
     return {
         "data": results,
         "metadata": {
@@ -129,7 +213,58 @@ def parallel_ai_call(companies: List[str], prompts: List[str], private_data, mod
         }
     }
 
-def generate_companies(company, number, model):
+def batch_ai_call(companies: List[str], prompts: List[str], private_map, model,
+                  batch_id: str = '') -> Dict[str, Any]:
+    """
+    Runs the company x prompt matrix through the provider's offline batch API
+    
+    Without a batch_id the requests are submitted and the new batch_id is returned.
+    With a batch_id the batch is polled, and once completed the results are laid
+    out like parallel_ai_call. Callers must send the same companies and prompts
+    on both invocations.
+    
+    Args:
+        companies: List of company names
+        prompts: List of prompts
+        private_map: dynamoDB data keyed by company, or None to not use private data
+        model: AIModel instance used for the call
+        batch_id: id of a previously submitted batch
+        
+    Returns:
+        Formatted output data
+    """
+    metadata = {
+        "companies": companies,
+        "prompts": prompts,
+    }
+    if not batch_id:
+        full_prompts = [build_sheet_prompt(company, prompt,
+                                           private_map.get(company) if private_map is not None else None)
+                        for company in companies for prompt in prompts]
+        return {
+            "batch_id": model.submit_batch(full_prompts),
+            "status": "submitted",
+            "metadata": metadata,
+        }
+
+    batch = model.poll_batch(batch_id)
+    if batch["status"] != "completed":
+        return {"batch_id": batch_id, "status": batch["status"], "metadata": metadata}
+
+    missing = "Error: no result returned for this request"
+    results = [
+        [company] + [batch["results"].get(str(ci * len(prompts) + pi), missing)
+                     for pi in range(len(prompts))]
+        for ci, company in enumerate(companies)
+    ]
+    return {
+        "batch_id": batch_id,
+        "status": "completed",
+        "data": results,
+        "metadata": metadata,
+    }
+
+async def agenerate_companies(company, number, model):
     """
     Generates a list of companies from target company name
 
@@ -152,22 +287,41 @@ def generate_companies(company, number, model):
         Output should ONLY be the name of the company, seperated with a comma.
         Do not output anything else. """
 
-    result = model.call(prompt)
+    # Each company name needs a handful of tokens; keep the cap proportional
+    result = await model.acall(prompt, max_tokens=max(ai_model.DEFAULT_MAX_TOKENS, 16 * int(number)))
     for company in result.split(","):
         companies.append(company.strip())
     return companies
   
-def read_dynamo(company): 
-    dynamodb = boto3.resource('dynamodb', region_name='us-west-2')
-    table = dynamodb.Table('qtp-ai-dynamo-db')
-    response = table.query(KeyConditionExpression=Key("name").eq(company))
-    print(response) #test
-    if "Items" in response:
-        return response["Items"]
-    else:
-        return {"statusCode": 404, "body": "Customer not found"}
-
-if __name__ == "__main__":
-    # Add freeze_support for Windows
-    freeze_support()
-    
+def batch_read_dynamo(companies: List[str]) -> Dict[str, Any]:
+    """
+    Reads the private data of every company with BatchGetItem, 100 keys per request
+
+    Args:
+        companies: List of company names
+
+    Returns:
+        Dict of company name to its list of dynamoDB items, empty when the
+        company has none
+
+    Raises:
+        RuntimeError: if keys are still unprocessed after BATCH_GET_ATTEMPTS requests
+    """
+    items = {}
+    names = list(dict.fromkeys(companies))
+    for start in range(0, len(names), BATCH_GET_SIZE):
+        request = {TABLE_NAME: {'Keys': [{'name': name} for name in names[start:start + BATCH_GET_SIZE]]}}
+        for attempt in range(1, BATCH_GET_ATTEMPTS + 1):
+            response = _DDB.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(TABLE_NAME, []):
+                items.setdefault(item['name'], []).append(item)
+            request = response.get('UnprocessedKeys') or {}
+            if not request:
+                break
+            # Throttled keys come back unprocessed; back off before retrying them
+            if attempt < BATCH_GET_ATTEMPTS:
+                time.sleep(min(0.05 * 2 ** attempt, 1))
+        else:
+            unread = len(request[TABLE_NAME]['Keys'])
+            raise RuntimeError(f"DynamoDB left {unread} keys unprocessed after {BATCH_GET_ATTEMPTS} attempts")
+    return {company: items.get(company, []) for company in companies}